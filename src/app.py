@@ -1,21 +1,50 @@
 import os
-import json
-from flask import Flask, request, jsonify
-from flask_cors import CORS
-from supabase import create_client, Client
+import asyncio
+import base64
+import hashlib
+import re
+import uuid
+import httpx
+import jwt
+import redis.asyncio as redis
+from quart import Quart, Response, g, request, jsonify
+from quart.json.provider import DefaultJSONProvider
+from quart_cors import cors
+from cachetools import TTLCache
+from postgrest.exceptions import APIError
+from prometheus_client import CONTENT_TYPE_LATEST, Histogram, generate_latest
+from supabase import acreate_client, AsyncClient, AsyncClientOptions
 from dotenv import load_dotenv
 import logging
-from datetime import datetime, timedelta
-import traceback
+from datetime import date, datetime, time, timedelta
+from time import perf_counter
+from functools import wraps
+import orjson
+from typing import NamedTuple, Optional
 
 # Cargar variables de entorno
 load_dotenv()
 
-# Configurar logging
-logging.basicConfig(level=logging.INFO)
+# Configurar logging (en producción conviene LOG_LEVEL=WARNING)
+logging.basicConfig(level=os.environ.get('LOG_LEVEL', 'INFO').upper())
 logger = logging.getLogger(__name__)
 
-app = Flask(__name__)
+class ORJSONProvider(DefaultJSONProvider):
+    """Serializa las respuestas con orjson en lugar del módulo json estándar"""
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(
+            obj,
+            default=self.default,
+            option=orjson.OPT_NON_STR_KEYS | orjson.OPT_NAIVE_UTC
+        ).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+app = Quart(__name__)
+app.json_provider_class = ORJSONProvider
+app.json = ORJSONProvider(app)
 
 # Configurar CORS de manera más permisiva para desarrollo
 #CORS(app, origins=["http://localhost:3000", "http://127.0.0.1:3000"], supports_credentials=True)
@@ -24,95 +53,311 @@ origins = [
     "http://localhost:3000",
     "http://127.0.0.1:3000", 
     "https://tu-frontend.netlify.app",  # Tu futuro frontend
-    "https://*.netlify.app"             # Cualquier subdominio Netlify
+    # quart-cors usa Pattern.match: anclar el final y admitir un solo subdominio
+    re.compile(r"https://[A-Za-z0-9-]+\.netlify\.app\Z")  # Cualquier subdominio Netlify
 ]
 
-CORS(app, resources={
-    r"/api/*": {
-        "origins": origins,
-        "methods": ["GET", "POST", "PUT", "DELETE", "OPTIONS"],
-        "allow_headers": ["Content-Type", "Authorization"]
-    }
-})
+# quart-cors también responde los preflight OPTIONS
+app = cors(
+    app,
+    allow_origin=origins,
+    allow_methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"],
+    allow_headers=["Content-Type", "Authorization"]
+)
 
 # Configuración Supabase
-try:
-    supabase_url = os.environ.get('SUPABASE_URL')
-    supabase_key = os.environ.get('SUPABASE_KEY')
-
-    if not supabase_url or not supabase_key:
-        logger.error("❌ Faltan variables de entorno SUPABASE_URL o SUPABASE_KEY")
-        supabase = None
-    else:
-        supabase: Client = create_client(supabase_url, supabase_key)
-        logger.info("✅ Cliente Supabase inicializado correctamente")
-        
-except Exception as e:
-    logger.error(f"❌ Error inicializando Supabase: {e}")
-    supabase = None
-
-# Manejar requests OPTIONS para CORS
-@app.before_request
-def handle_options():
-    if request.method == "OPTIONS":
-        response = jsonify({"status": "ok"})
-        response.headers.add("Access-Control-Allow-Origin", "*")
-        response.headers.add("Access-Control-Allow-Headers", "Content-Type,Authorization")
-        response.headers.add("Access-Control-Allow-Methods", "GET,POST,PUT,DELETE,OPTIONS")
-        return response
+# El cliente asíncrono debe crearse dentro del event loop, por eso se
+# inicializa al arrancar el servidor y no al importar el módulo.
+# Es un singleton: todos los endpoints comparten el mismo cliente y su pool
+# de conexiones HTTP, de modo que las sesiones TCP+TLS se reutilizan entre
+# requests en lugar de negociarse en cada llamada.
+# Son conexiones HTTP a PostgREST/GoTrue (no cuentan contra el pooler de
+# Postgres). Se usa HTTP/2, como hacen por defecto los clientes de postgrest
+# y gotrue, para multiplexar muchos requests sobre cada conexión; los límites
+# son los de httpx por defecto para no encolar requests en el pool.
+# keepalive_expiry recicla las conexiones ociosas antes de que el servidor
+# las cierre por su cuenta.
+SUPABASE_POOL_LIMITS = httpx.Limits(
+    max_connections=100,
+    max_keepalive_connections=20,
+    keepalive_expiry=30.0
+)
+SUPABASE_TIMEOUT = 30.0
+
+# Sin credenciales de Supabase la API no puede funcionar: fallar al importar
+# en lugar de arrancar y devolver 500 confusos en cada request. Con
+# FLASK_ENV=test se permite importar el módulo sin ellas y no se crea ningún
+# cliente: quien lo importe así debe asignar el suyo al atributo de módulo
+# `supabase` antes de llamar a los endpoints.
+TESTING = os.environ.get('FLASK_ENV') == 'test'
+supabase_url = os.environ.get('SUPABASE_URL')
+supabase_key = os.environ.get('SUPABASE_KEY')
+
+if not TESTING and (not supabase_url or not supabase_key):
+    raise RuntimeError("Faltan variables de entorno SUPABASE_URL o SUPABASE_KEY")
+
+# Se asigna en init_supabase antes de atender el primer request, así que los
+# endpoints lo usan sin comprobar None. El None inicial solo queda en
+# FLASK_ENV=test si nadie asigna un cliente.
+supabase: AsyncClient = None  # type: ignore[assignment]
+http_client: Optional[httpx.AsyncClient] = None
+
+@app.before_serving
+async def init_supabase():
+    global supabase, http_client
+    if TESTING:
+        return
+
+    # Un error aquí aborta el arranque del servidor
+    http_client = httpx.AsyncClient(
+        http2=True,
+        limits=SUPABASE_POOL_LIMITS,
+        timeout=SUPABASE_TIMEOUT
+    )
+    supabase = await acreate_client(
+        supabase_url,
+        supabase_key,
+        options=AsyncClientOptions(httpx_client=http_client)
+    )
+    logger.info("✅ Cliente Supabase inicializado correctamente")
+
+@app.after_serving
+async def close_supabase():
+    if http_client is not None:
+        await http_client.aclose()
 
 # ==================== MIDDLEWARE DE AUTENTICACIÓN ====================
-def check_auth():
-    """Verifica que el usuario esté autenticado"""
+# Cache de usuarios ya validados para no llamar a Supabase en cada request.
+# La clave es un hash del token (nunca el token en claro) y el TTL es muy
+# inferior a la expiración de los JWT de Supabase (1 hora por defecto).
+AUTH_CACHE_TTL = 45
+_auth_cache = TTLCache(maxsize=10000, ttl=AUTH_CACHE_TTL)
+
+# Con SUPABASE_JWT_SECRET configurada los tokens se verifican localmente
+# (firma HS256, expiración y audiencia) sin ninguna llamada de red. Sin ella
+# se mantiene la validación contra Supabase con la cache anterior.
+supabase_jwt_secret = os.environ.get('SUPABASE_JWT_SECRET')
+if not supabase_jwt_secret:
+    logger.warning("⚠️ SUPABASE_JWT_SECRET no configurada, los tokens se validarán contra Supabase")
+
+class AuthUser(NamedTuple):
+    """Usuario mínimo obtenido de los claims de un JWT verificado"""
+    id: str
+    email: Optional[str]
+
+def _decode_token(token):
+    """Verifica el JWT localmente y devuelve el usuario, o None si no es válido"""
+    try:
+        payload = jwt.decode(
+            token,
+            supabase_jwt_secret,
+            algorithms=['HS256'],
+            audience='authenticated',
+            options={'require': ['exp', 'sub']}
+        )
+    except jwt.PyJWTError as e:
+        logger.warning("❌ Token inválido: %s", e)
+        return None
+
+    return AuthUser(id=payload['sub'], email=payload.get('email'))
+
+def _token_hash(token):
+    return hashlib.sha256(token.encode()).hexdigest()[:32]
+
+def _get_bearer_token():
+    """Extrae el token Bearer del header Authorization"""
     auth_header = request.headers.get('Authorization')
-    logger.info(f"🔐 Header de autorización recibido: {auth_header}")
-    
+
     if not auth_header or not auth_header.startswith('Bearer '):
-        logger.warning("❌ No se proporcionó token de autorización")
         return None
-    
-    token = auth_header.replace('Bearer ', '')
+
+    return auth_header.replace('Bearer ', '')
+
+async def check_auth():
+    """Verifica que el usuario esté autenticado"""
+    token = _get_bearer_token()
+    if not token:
+        logger.debug("❌ No se proporcionó token de autorización")
+        return None
+
+    # Un JWT siempre tiene tres segmentos (header.payload.firma): descartar
+    # cualquier otra cosa sin llegar a Supabase
+    if token.count('.') != 2:
+        logger.warning("❌ Token con formato inválido")
+        return None
+
+    if supabase_jwt_secret:
+        return _decode_token(token)
+
+    token_hash = _token_hash(token)
+    cached_user = _auth_cache.get(token_hash)
+    if cached_user is not None:
+        return cached_user
     
     try:
-        user = supabase.auth.get_user(token)
+        user = await supabase.auth.get_user(token)
         if user and user.user:
-            logger.info(f"✅ Usuario autenticado: {user.user.email}")
+            logger.debug("✅ Usuario autenticado: %s", user.user.email)
+            _auth_cache[token_hash] = user.user
             return user.user
         logger.warning("❌ Token inválido o usuario no encontrado")
         return None
     except Exception as e:
-        logger.error(f"❌ Error de autenticación: {e}")
+        logger.error("❌ Error de autenticación: %s", e)
+        return None
+
+def require_auth(fn):
+    """Decorador que exige usuario autenticado y lo pasa como primer argumento"""
+    @wraps(fn)
+    async def wrapper(*args, **kwargs):
+        user = await check_auth()
+        if not user:
+            return jsonify({'error': 'No autorizado'}), 401
+        g.user_id = str(user.id)
+        return await fn(user, *args, **kwargs)
+    return wrapper
+
+@app.route('/api/auth/invalidate', methods=['POST'])
+async def invalidate_auth():
+    """Descartar el token cacheado (llamar al hacer logout)
+
+    Solo afecta a la validación contra Supabase: un JWT verificado localmente
+    sigue siendo válido hasta su expiración.
+    """
+    token = _get_bearer_token()
+    if not token:
+        return jsonify({'error': 'No autorizado'}), 401
+
+    _auth_cache.pop(_token_hash(token), None)
+    return jsonify({'message': 'Sesión invalidada correctamente'})
+
+# ==================== CACHE (REDIS) ====================
+# Cache-aside de los listados por usuario. Si REDIS_URL no está configurada
+# la cache queda deshabilitada y todo se lee directamente de Supabase.
+CACHE_TTL = 60
+
+redis_url = os.environ.get('REDIS_URL')
+if redis_url:
+    redis_client = redis.Redis.from_url(redis_url, decode_responses=True)
+else:
+    logger.warning("⚠️ REDIS_URL no configurada, cache deshabilitada")
+    redis_client = None
+
+def _cache_key(resource, user_id):
+    return f'{resource}:{user_id}'
+
+async def _cache_get_many(*keys):
+    """Lee varias claves en un solo round-trip; None si no hay cache"""
+    if redis_client is None:
+        return [None] * len(keys)
+    try:
+        return await redis_client.mget(keys)
+    except Exception as e:
+        logger.warning("⚠️ Error leyendo cache: %s", e)
+        return [None] * len(keys)
+
+async def _cache_get(key):
+    return (await _cache_get_many(key))[0]
+
+async def _cache_set(key, value):
+    if redis_client is None:
+        return
+    try:
+        await redis_client.setex(key, CACHE_TTL, value)
+    except Exception as e:
+        logger.warning("⚠️ Error escribiendo cache: %s", e)
+
+async def _cache_invalidate(*keys):
+    if redis_client is None:
+        return
+    try:
+        await redis_client.delete(*keys)
+    except Exception as e:
+        logger.warning("⚠️ Error invalidando cache: %s", e)
+
+@app.after_serving
+async def close_redis():
+    if redis_client is not None:
+        await redis_client.aclose()
+
+# ==================== MÉTRICAS ====================
+# Tiempo por request para detectar el camino lento antes de optimizar.
+# En respuestas en streaming (backup) mide hasta el primer byte.
+SLOW_REQUEST_MS = 500
+
+REQUEST_LATENCY = Histogram(
+    'http_request_duration_seconds',
+    'Duración de los requests HTTP',
+    ['method', 'endpoint', 'status']
+)
+
+@app.before_request
+async def start_timer():
+    g.start_time = perf_counter()
+
+@app.after_request
+async def record_timing(response):
+    start_time = g.get('start_time')
+    if start_time is None:
+        return response
+
+    elapsed = perf_counter() - start_time
+    elapsed_ms = elapsed * 1000
+    # Usar la ruta registrada (no el path real) para acotar las etiquetas
+    endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+    REQUEST_LATENCY.labels(request.method, endpoint, response.status_code).observe(elapsed)
+    response.headers['Server-Timing'] = f'app;dur={elapsed_ms:.1f}'
+
+    if elapsed_ms > SLOW_REQUEST_MS:
+        user_id = g.get('user_id')
+        logger.warning(
+            "🐢 Request lento %s %s %.0fms usuario=%s tamaño=%s",
+            request.method,
+            request.path,
+            elapsed_ms,
+            hashlib.sha256(user_id.encode()).hexdigest()[:12] if user_id else '-',
+            response.content_length
+        )
+    return response
+
+@app.route('/metrics')
+async def metrics():
+    return Response(generate_latest(), mimetype=CONTENT_TYPE_LATEST)
+
+# ==================== UTILIDADES DE REQUEST ====================
+async def _read_json():
+    """Lee el body una sola vez (sin cachearlo) y lo decodifica con orjson
+
+    Devuelve None si el body no es un objeto JSON válido.
+    """
+    raw = await request.get_data(cache=False)
+    try:
+        data = orjson.loads(raw)
+    except orjson.JSONDecodeError:
         return None
+    return data if isinstance(data, dict) else None
 
 # ==================== ENDPOINTS PÚBLICOS (SIN AUTENTICACIÓN) ====================
 
 @app.route('/')
-def home():
+async def home():
     return jsonify({
         "message": "🚀 API de Ventas Personal funcionando!",
         "status": "success",
-        "timestamp": datetime.now().isoformat(),
-        "supabase_connected": supabase is not None
+        "timestamp": datetime.now().isoformat()
     })
 
 @app.route('/api/health')
-def health_check():
+async def health_check():
     try:
-        if supabase is None:
-            return jsonify({
-                "status": "degraded",
-                "database": "disconnected - configura Supabase",
-                "timestamp": datetime.now().isoformat()
-            }), 200
-            
-        response = supabase.table('products').select('id').limit(1).execute()
+        response = await supabase.table('products').select('id').limit(1).execute()
         return jsonify({
             "status": "healthy",
             "database": "connected",
             "timestamp": datetime.now().isoformat()
         })
     except Exception as e:
-        logger.error(f"Error en health check: {e}")
+        logger.error("Error en health check: %s", e)
         return jsonify({
             "status": "unhealthy",
             "database": "disconnected",
@@ -122,39 +367,37 @@ def health_check():
 # ==================== ENDPOINTS DE PRODUCTOS ====================
 
 @app.route('/api/products', methods=['GET'])
-def get_products():
+@require_auth
+async def get_products(user):
     """Obtener todos los productos del usuario"""
-    user = check_auth()
-    if not user:
-        return jsonify({'error': 'No autorizado'}), 401
-    
     try:
-        response = supabase.table('products')\
+        cache_key = _cache_key('products', user.id)
+        cached = await _cache_get(cache_key)
+        if cached is not None:
+            return Response(cached, mimetype='application/json')
+        
+        response = await supabase.table('products')\
             .select('*')\
             .eq('user_id', user.id)\
             .order('created_at', desc=True)\
             .execute()
+        await _cache_set(cache_key, app.json.dumps(response.data))
         
-        # Verificar productos con stock bajo
-        products = response.data
-        for product in products:
-            product['low_stock'] = product['stock'] <= product.get('low_stock_alert', 5)
-        
-        return jsonify(products)
+        # La columna generada low_stock ya viene calculada desde Postgres
+        return jsonify(response.data)
     except Exception as e:
-        logger.error(f"Error obteniendo productos: {e}")
+        logger.error("Error obteniendo productos: %s", e)
         return jsonify({'error': 'Error obteniendo productos'}), 500
 
 @app.route('/api/products', methods=['POST'])
-def create_product():
+@require_auth
+async def create_product(user):
     """Crear un nuevo producto"""
-    user = check_auth()
-    if not user:
-        return jsonify({'error': 'No autorizado'}), 401
-    
     try:
-        data = request.get_json()
-        logger.info(f"📦 Creando producto: {data}")
+        data = await _read_json()
+        if data is None:
+            return jsonify({'error': 'El body debe ser un objeto JSON válido'}), 400
+        logger.debug("📦 Creando producto: %s", data)
         
         # Validaciones básicas
         if not data.get('name') or not data.get('price'):
@@ -169,7 +412,8 @@ def create_product():
             'user_id': user.id
         }
         
-        response = supabase.table('products').insert(product_data).execute()
+        response = await supabase.table('products').insert(product_data).execute()
+        await _cache_invalidate(_cache_key('products', user.id))
         
         if response.data:
             return jsonify(response.data[0])
@@ -177,28 +421,17 @@ def create_product():
             return jsonify({'error': 'Error creando producto'}), 400
             
     except Exception as e:
-        logger.error(f"Error creando producto: {e}")
+        logger.error("Error creando producto: %s", e)
         return jsonify({'error': 'Error creando producto'}), 500
 
 @app.route('/api/products/<product_id>', methods=['PUT'])
-def update_product(product_id):
+@require_auth
+async def update_product(user, product_id):
     """Actualizar un producto existente"""
-    user = check_auth()
-    if not user:
-        return jsonify({'error': 'No autorizado'}), 401
-    
     try:
-        data = request.get_json()
-        
-        # Verificar que el producto pertenece al usuario
-        existing_product = supabase.table('products')\
-            .select('*')\
-            .eq('id', product_id)\
-            .eq('user_id', user.id)\
-            .execute()
-        
-        if not existing_product.data:
-            return jsonify({'error': 'Producto no encontrado'}), 404
+        data = await _read_json()
+        if data is None:
+            return jsonify({'error': 'El body debe ser un objeto JSON válido'}), 400
         
         # Preparar datos para actualizar
         update_data = {}
@@ -213,213 +446,237 @@ def update_product(product_id):
         if 'low_stock_alert' in data:
             update_data['low_stock_alert'] = int(data['low_stock_alert'])
         
-        response = supabase.table('products')\
+        if not update_data:
+            return jsonify({'error': 'No hay campos para actualizar'}), 400
+        
+        # El filtro por user_id ya garantiza la pertenencia: si no se
+        # actualizó ninguna fila, el producto no existe o no es del usuario
+        response = await supabase.table('products')\
             .update(update_data)\
             .eq('id', product_id)\
             .eq('user_id', user.id)\
             .execute()
         
-        if response.data:
-            return jsonify(response.data[0])
-        else:
-            return jsonify({'error': 'Error actualizando producto'}), 400
+        if not response.data:
+            return jsonify({'error': 'Producto no encontrado'}), 404
+        
+        await _cache_invalidate(_cache_key('products', user.id))
+        return jsonify(response.data[0])
             
     except Exception as e:
-        logger.error(f"Error actualizando producto: {e}")
+        logger.error("Error actualizando producto: %s", e)
         return jsonify({'error': 'Error actualizando producto'}), 500
 
 @app.route('/api/products/<product_id>', methods=['DELETE'])
-def delete_product(product_id):
+@require_auth
+async def delete_product(user, product_id):
     """Eliminar un producto"""
-    user = check_auth()
-    if not user:
-        return jsonify({'error': 'No autorizado'}), 401
-    
     try:
-        # Verificar que el producto pertenece al usuario
-        existing_product = supabase.table('products')\
-            .select('*')\
+        # DELETE devuelve las filas borradas: vacío si no existe o no es del usuario
+        response = await supabase.table('products')\
+            .delete()\
             .eq('id', product_id)\
             .eq('user_id', user.id)\
             .execute()
         
-        if not existing_product.data:
+        if not response.data:
             return jsonify({'error': 'Producto no encontrado'}), 404
         
-        response = supabase.table('products')\
-            .delete()\
-            .eq('id', product_id)\
-            .eq('user_id', user.id)\
-            .execute()
-        
+        await _cache_invalidate(_cache_key('products', user.id))
         return jsonify({'message': 'Producto eliminado correctamente'})
         
     except Exception as e:
-        logger.error(f"Error eliminando producto: {e}")
+        logger.error("Error eliminando producto: %s", e)
         return jsonify({'error': 'Error eliminando producto'}), 500
 
 # ==================== ENDPOINTS DE VENTAS ====================
 
+# SQLSTATE de los errores de process_sale y su código HTTP
+SALE_ERROR_STATUS = {
+    'LS001': 400,  # datos de la venta inválidos
+    'LS002': 400,  # stock insuficiente
+    'LS003': 404,  # producto no encontrado
+}
+
+# Límite del tipo integer de Postgres (sale_items.quantity, products.stock)
+MAX_QUANTITY = 2**31 - 1
+
+def _is_uuid(value):
+    if not isinstance(value, str):
+        return False
+    try:
+        uuid.UUID(value)
+    except ValueError:
+        return False
+    return True
+
+def _is_valid_sale_item(item):
+    """Comprueba tipos y rangos antes de enviar el item a process_sale"""
+    if not isinstance(item, dict):
+        return False
+    quantity = item.get('quantity')
+    unit_price = item.get('unit_price')
+    return (
+        _is_uuid(item.get('product_id'))
+        # bool es subclase de int: excluirlo explícitamente
+        and isinstance(quantity, int) and not isinstance(quantity, bool)
+        and 0 < quantity <= MAX_QUANTITY
+        and (unit_price is None
+             or (isinstance(unit_price, (int, float)) and not isinstance(unit_price, bool)))
+    )
+
 @app.route('/api/sales', methods=['POST'])
-def create_sale():
+@require_auth
+async def create_sale(user):
     """Registrar una nueva venta - VERSIÓN MEJORADA"""
-    user = check_auth()
-    if not user:
-        return jsonify({'error': 'No autorizado'}), 401
-    
     try:
-        data = request.get_json()
-        logger.info(f"💰 Creando venta: {data}")
+        data = await _read_json()
+        if data is None:
+            return jsonify({'error': 'El body debe ser un objeto JSON válido'}), 400
+        logger.debug("💰 Creando venta: %s", data)
         
         # Validaciones básicas
-        if not data.get('items') or len(data['items']) == 0:
+        items = data.get('items') or []
+        if not isinstance(items, list) or not items:
             return jsonify({'error': 'La venta debe tener al menos un item'}), 400
         
-        # Calcular total y verificar stock
-        total = 0
-        items_to_process = []
+        for item in items:
+            if not _is_valid_sale_item(item):
+                return jsonify({'error': 'Cada item debe tener product_id y quantity (entero positivo)'}), 400
         
-        for item in data['items']:
-            if not item.get('product_id') or not item.get('quantity'):
-                return jsonify({'error': 'Cada item debe tener product_id y quantity'}), 400
-            
-            # Verificar stock disponible
-            product_response = supabase.table('products')\
-                .select('id, name, stock, price')\
-                .eq('id', item['product_id'])\
-                .eq('user_id', user.id)\
-                .execute()
-            
-            if not product_response.data:
-                return jsonify({'error': f"Producto {item['product_id']} no encontrado"}), 404
-            
-            product = product_response.data[0]
-            if product['stock'] < item['quantity']:
-                return jsonify({'error': f"Stock insuficiente para {product['name']}. Stock disponible: {product['stock']}"}), 400
-            
-            item_price = item.get('unit_price', product['price'])
-            total += item_price * item['quantity']
-            
-            # Guardar información del producto para procesar después
-            items_to_process.append({
-                'product': product,
-                'item_data': item,
-                'unit_price': item_price
-            })
-        
-        # Crear la venta
-        sale_data = {
-            'total': total,
-            'customer_id': data.get('customer_id') or None,  # Asegurar que sea NULL si está vacío
-            'user_id': user.id
-        }
+        customer_id = data.get('customer_id') or None  # Asegurar que sea NULL si está vacío
+        if customer_id is not None and not _is_uuid(customer_id):
+            return jsonify({'error': 'customer_id no es válido'}), 400
         
-        logger.info(f"📝 Creando venta con datos: {sale_data}")
-        sale_response = supabase.table('sales').insert(sale_data).execute()
+        # process_sale bloquea los productos (SELECT ... FOR UPDATE), valida el
+        # stock, crea la venta con sus items y descuenta el inventario en una
+        # sola transacción
+        sale_items = [
+            {key: item[key] for key in ('product_id', 'quantity', 'unit_price') if key in item}
+            for item in items
+        ]
+        try:
+            sale_response = await supabase.rpc('process_sale', {
+                'p_user': user.id,
+                'p_customer': customer_id,
+                'p_items': sale_items
+            }).execute()
+        except APIError as e:
+            status = SALE_ERROR_STATUS.get(e.code)
+            if status is None:
+                raise
+            return jsonify({'error': e.message}), status
+        
+        # La venta descuenta stock: invalidar el listado de productos
+        await _cache_invalidate(_cache_key('products', user.id))
         
         if not sale_response.data:
             logger.error("❌ Error creando la venta en la base de datos")
             return jsonify({'error': 'Error creando la venta en la base de datos'}), 400
         
-        sale_id = sale_response.data[0]['id']
-        logger.info(f"✅ Venta creada con ID: {sale_id}")
-        
-        # Crear items de venta y actualizar stock
-        for item_info in items_to_process:
-            product = item_info['product']
-            item_data = item_info['item_data']
-            unit_price = item_info['unit_price']
-            
-            # Crear item de venta
-            sale_item_data = {
-                'sale_id': sale_id,
-                'product_id': item_data['product_id'],
-                'quantity': item_data['quantity'],
-                'unit_price': unit_price
-            }
-            
-            logger.info(f"📦 Creando item de venta: {sale_item_data}")
-            item_response = supabase.table('sale_items').insert(sale_item_data).execute()
-            
-            if not item_response.data:
-                logger.error(f"❌ Error creando item para producto {product['id']}")
-                # Si falla un item, revertir la venta
-                supabase.table('sales').delete().eq('id', sale_id).execute()
-                return jsonify({'error': f"Error creando item para {product['name']}"}), 400
-            
-            # Actualizar stock del producto
-            new_stock = product['stock'] - item_data['quantity']
-            logger.info(f"🔄 Actualizando stock de {product['name']}: {product['stock']} -> {new_stock}")
-            
-            update_response = supabase.table('products')\
-                .update({'stock': new_stock})\
-                .eq('id', product['id'])\
-                .execute()
-            
-            if not update_response.data:
-                logger.error(f"❌ Error actualizando stock para {product['name']}")
-                # Revertir la venta si falla la actualización de stock
-                supabase.table('sales').delete().eq('id', sale_id).execute()
-                supabase.table('sale_items').delete().eq('sale_id', sale_id).execute()
-                return jsonify({'error': f"Error actualizando stock para {product['name']}"}), 400
-        
-        logger.info(f"✅ Venta {sale_id} completada exitosamente")
-        return jsonify(sale_response.data[0])
+        logger.debug("✅ Venta %s completada exitosamente", sale_response.data['id'])
+        return jsonify(sale_response.data)
         
     except Exception as e:
-        logger.error(f"❌ Error creando venta: {str(e)}")
-        logger.error(f"🔍 Traceback: {traceback.format_exc()}")
-        return jsonify({'error': f'Error interno del servidor: {str(e)}'}), 500
+        logger.exception("❌ Error creando venta: %s", e)
+        return jsonify({'error': 'Error interno del servidor'}), 500
+
+SALES_PAGE_SIZE = 50
+SALES_MAX_PAGE_SIZE = 200
+
+def _encode_sales_cursor(sale):
+    """Cursor opaco con la clave (sale_date, id) de la última venta de la página"""
+    return base64.urlsafe_b64encode(orjson.dumps([sale['sale_date'], sale['id']])).decode()
+
+def _decode_sales_cursor(cursor):
+    """Devuelve (sale_date, id) del cursor, o None si no es válido"""
+    try:
+        sale_date, sale_id = orjson.loads(base64.urlsafe_b64decode(cursor.encode()))
+        # Validar el formato de la fecha (Python < 3.11 no acepta el sufijo Z)
+        datetime.fromisoformat(sale_date.replace('Z', '+00:00'))
+    except (ValueError, TypeError, AttributeError):
+        return None
+    # El id se interpola entre comillas en el filtro de PostgREST
+    if not isinstance(sale_id, str) or not sale_id or '"' in sale_id:
+        return None
+    return sale_date, sale_id
 
 @app.route('/api/sales', methods=['GET'])
-def get_sales():
-    """Obtener todas las ventas del usuario"""
-    user = check_auth()
-    if not user:
-        return jsonify({'error': 'No autorizado'}), 401
+@require_auth
+async def get_sales(user):
+    """Obtener las ventas del usuario, paginadas por (sale_date, id) (?cursor=&limit=)"""
+    try:
+        limit = min(int(request.args.get('limit', SALES_PAGE_SIZE)), SALES_MAX_PAGE_SIZE)
+    except ValueError:
+        return jsonify({'error': 'El parámetro limit debe ser un número'}), 400
+    limit = max(limit, 1)
+    
+    cursor = None
+    if request.args.get('cursor'):
+        cursor = _decode_sales_cursor(request.args['cursor'])
+        if cursor is None:
+            return jsonify({'error': 'El parámetro cursor no es válido'}), 400
     
     try:
-        response = supabase.table('sales')\
+        query = supabase.table('sales')\
             .select('*, sale_items(*, products(*)), customers(*)')\
-            .eq('user_id', user.id)\
+            .eq('user_id', user.id)
+        if cursor:
+            # Keyset sobre (sale_date, id): las ventas con la misma fecha que
+            # el límite de la página no se saltan
+            sale_date, sale_id = cursor
+            query = query.or_(
+                f'sale_date.lt."{sale_date}",'
+                f'and(sale_date.eq."{sale_date}",id.lt."{sale_id}")'
+            )
+        
+        response = await query\
             .order('sale_date', desc=True)\
+            .order('id', desc=True)\
+            .limit(limit)\
             .execute()
         
-        return jsonify(response.data)
+        rows = response.data
+        return jsonify({
+            'data': rows,
+            'next_cursor': _encode_sales_cursor(rows[-1]) if len(rows) == limit else None
+        })
     except Exception as e:
-        logger.error(f"Error obteniendo ventas: {e}")
+        logger.error("Error obteniendo ventas: %s", e)
         return jsonify({'error': 'Error obteniendo ventas'}), 500
 
 # ==================== ENDPOINTS DE CLIENTES ====================
 
 @app.route('/api/customers', methods=['GET'])
-def get_customers():
+@require_auth
+async def get_customers(user):
     """Obtener todos los clientes del usuario"""
-    user = check_auth()
-    if not user:
-        return jsonify({'error': 'No autorizado'}), 401
-    
     try:
-        response = supabase.table('customers')\
+        cache_key = _cache_key('customers', user.id)
+        cached = await _cache_get(cache_key)
+        if cached is not None:
+            return Response(cached, mimetype='application/json')
+        
+        response = await supabase.table('customers')\
             .select('*')\
             .eq('user_id', user.id)\
             .order('created_at', desc=True)\
             .execute()
+        await _cache_set(cache_key, app.json.dumps(response.data))
         
         return jsonify(response.data)
     except Exception as e:
-        logger.error(f"Error obteniendo clientes: {e}")
+        logger.error("Error obteniendo clientes: %s", e)
         return jsonify({'error': 'Error obteniendo clientes'}), 500
 
 @app.route('/api/customers', methods=['POST'])
-def create_customer():
+@require_auth
+async def create_customer(user):
     """Crear un nuevo cliente"""
-    user = check_auth()
-    if not user:
-        return jsonify({'error': 'No autorizado'}), 401
-    
     try:
-        data = request.get_json()
+        data = await _read_json()
+        if data is None:
+            return jsonify({'error': 'El body debe ser un objeto JSON válido'}), 400
         
         if not data.get('name'):
             return jsonify({'error': 'El nombre es requerido'}), 400
@@ -431,7 +688,8 @@ def create_customer():
             'user_id': user.id
         }
         
-        response = supabase.table('customers').insert(customer_data).execute()
+        response = await supabase.table('customers').insert(customer_data).execute()
+        await _cache_invalidate(_cache_key('customers', user.id))
         
         if response.data:
             return jsonify(response.data[0])
@@ -439,92 +697,126 @@ def create_customer():
             return jsonify({'error': 'Error creando cliente'}), 400
             
     except Exception as e:
-        logger.error(f"Error creando cliente: {e}")
+        logger.error("Error creando cliente: %s", e)
         return jsonify({'error': 'Error creando cliente'}), 500
 
 # ==================== ENDPOINTS DE REPORTES ====================
 
 @app.route('/api/reports/daily-sales')
-def daily_sales():
+@require_auth
+async def daily_sales(user):
     """Obtener ventas del día actual"""
-    user = check_auth()
-    if not user:
-        return jsonify({'error': 'No autorizado'}), 401
-    
     try:
-        date_str = request.args.get('date', datetime.now().strftime('%Y-%m-%d'))
-        
-        response = supabase.table('sales')\
+        date_str = request.args.get('date')
+        try:
+            day = date.fromisoformat(date_str) if date_str else date.today()
+        except ValueError:
+            return jsonify({'error': 'Fecha inválida, usa el formato YYYY-MM-DD'}), 400
+        
+        # Rango semiabierto [día, día siguiente) para usar el índice por fecha
+        start = datetime.combine(day, time.min)
+        response = await supabase.table('sales')\
             .select('*, sale_items(*)')\
             .eq('user_id', user.id)\
-            .gte('sale_date', f'{date_str} 00:00:00')\
-            .lte('sale_date', f'{date_str} 23:59:59')\
+            .gte('sale_date', start.isoformat())\
+            .lt('sale_date', (start + timedelta(days=1)).isoformat())\
             .execute()
         
         return jsonify(response.data)
     except Exception as e:
-        logger.error(f"Error obteniendo ventas diarias: {e}")
+        logger.error("Error obteniendo ventas diarias: %s", e)
         return jsonify({'error': 'Error obteniendo ventas diarias'}), 500
 
 # ==================== ENDPOINTS DE UTILIDAD ====================
 
+# Tamaño de página al leer tablas completas: acota la memoria del backup
+BACKUP_PAGE_SIZE = 1000
+
+def _backup_page(table, user_id, offset):
+    return supabase.table(table)\
+        .select('*')\
+        .eq('user_id', user_id)\
+        .order('id')\
+        .range(offset, offset + BACKUP_PAGE_SIZE - 1)\
+        .execute()
+
 @app.route('/api/backup', methods=['GET'])
-def backup_data():
-    """Exportar todos los datos del usuario"""
-    user = check_auth()
-    if not user:
-        return jsonify({'error': 'No autorizado'}), 401
-    
+@require_auth
+async def backup_data(user):
+    """Exportar todos los datos del usuario (respuesta en streaming)"""
     try:
         tables = ['products', 'customers', 'sales']
-        backup = {}
-        
-        for table in tables:
-            response = supabase.table(table)\
-                .select('*')\
-                .eq('user_id', user.id)\
-                .execute()
-            backup[table] = response.data
-        
-        return jsonify(backup)
+        user_id = user.id
+        
+        # Productos y clientes pueden estar en cache: leerlos en un solo round-trip
+        cached = dict(zip(
+            ['products', 'customers'],
+            await _cache_get_many(
+                _cache_key('products', user_id),
+                _cache_key('customers', user_id)
+            )
+        ))
+        
+        # Primera página de las tablas sin cache en paralelo, antes de empezar
+        # a responder, para que un fallo de Supabase todavía devuelva un 500
+        pending = [table for table in tables if cached.get(table) is None]
+        first_pages = dict(zip(pending, await asyncio.gather(*(
+            _backup_page(table, user_id, 0) for table in pending
+        ))))
     except Exception as e:
-        logger.error(f"Error creando backup: {e}")
+        logger.error("Error creando backup: %s", e)
         return jsonify({'error': 'Error creando backup'}), 500
-
-if __name__ == '__main__':
-    port = int(os.environ.get('PORT', 5000))
-    debug_mode = os.environ.get('FLASK_DEBUG', 'False').lower() == 'true'
     
-    logger.info("=" * 50)
-    logger.info("🚀 INICIANDO SERVIDOR FLASK")
-    logger.info(f"📍 Puerto: {port}")
-    logger.info(f"🐛 Debug: {debug_mode}")
-    logger.info(f"🔗 Supabase: {'✅ Conectado' if supabase else '❌ No conectado'}")
-    logger.info("=" * 50)
+    async def generate():
+        yield b'{'
+        array_open = False
+        try:
+            for index, table in enumerate(tables):
+                if index:
+                    yield b','
+                yield orjson.dumps(table) + b':'
+                
+                if table not in first_pages:
+                    yield cached[table].encode()
+                    continue
+                
+                # Emitir la tabla página a página
+                yield b'['
+                array_open = True
+                offset = 0
+                rows = first_pages.pop(table).data
+                while rows:
+                    if offset:
+                        yield b','
+                    yield b','.join(orjson.dumps(row) for row in rows)
+                    if len(rows) < BACKUP_PAGE_SIZE:
+                        break
+                    offset += BACKUP_PAGE_SIZE
+                    rows = (await _backup_page(table, user_id, offset)).data
+                yield b']'
+                array_open = False
+        except Exception as e:
+            # Los headers (200) ya se enviaron: cerrar el JSON y marcar el
+            # backup como incompleto para que el cliente detecte el fallo
+            logger.error("Error creando backup: %s", e)
+            if array_open:
+                yield b']'
+            yield b',"error":"backup incompleto"}'
+            return
+        yield b'}'
     
-    app.run(debug=debug_mode, port=port, host='0.0.0.0')
+    return Response(generate(), mimetype='application/json')
 
 # ==================== ENDPOINTS DE CLIENTES (COMPLETOS) ====================
 
 @app.route('/api/customers/<customer_id>', methods=['PUT'])
-def update_customer(customer_id):
+@require_auth
+async def update_customer(user, customer_id):
     """Actualizar un cliente existente"""
-    user = check_auth()
-    if not user:
-        return jsonify({'error': 'No autorizado'}), 401
-    
     try:
-        data = request.get_json()
-        
-        # Verificar que el cliente pertenece al usuario
-        existing_customer = supabase.table('customers')\
-            .select('*')\
-            .eq('id', customer_id)\
-            .eq('user_id', user.id)\
-            .execute()
-        
-        if not existing_customer.data:
-            return jsonify({'error': 'Cliente no encontrado'}), 404
+        data = await _read_json()
+        if data is None:
+            return jsonify({'error': 'El body debe ser un objeto JSON válido'}), 400
         
         update_data = {}
         if 'name' in data:
@@ -534,92 +826,78 @@ def update_customer(customer_id):
         if 'phone' in data:
             update_data['phone'] = data['phone']
         
-        response = supabase.table('customers')\
+        if not update_data:
+            return jsonify({'error': 'No hay campos para actualizar'}), 400
+        
+        # El filtro por user_id ya garantiza la pertenencia: si no se
+        # actualizó ninguna fila, el cliente no existe o no es del usuario
+        response = await supabase.table('customers')\
             .update(update_data)\
             .eq('id', customer_id)\
             .eq('user_id', user.id)\
             .execute()
         
-        if response.data:
-            return jsonify(response.data[0])
-        else:
-            return jsonify({'error': 'Error actualizando cliente'}), 400
+        if not response.data:
+            return jsonify({'error': 'Cliente no encontrado'}), 404
+        
+        await _cache_invalidate(_cache_key('customers', user.id))
+        return jsonify(response.data[0])
             
     except Exception as e:
-        logger.error(f"Error actualizando cliente: {e}")
+        logger.error("Error actualizando cliente: %s", e)
         return jsonify({'error': 'Error actualizando cliente'}), 500
 
 @app.route('/api/customers/<customer_id>', methods=['DELETE'])
-def delete_customer(customer_id):
+@require_auth
+async def delete_customer(user, customer_id):
     """Eliminar un cliente"""
-    user = check_auth()
-    if not user:
-        return jsonify({'error': 'No autorizado'}), 401
-    
     try:
-        # Verificar que el cliente pertenece al usuario
-        existing_customer = supabase.table('customers')\
-            .select('*')\
+        # DELETE devuelve las filas borradas: vacío si no existe o no es del usuario
+        response = await supabase.table('customers')\
+            .delete()\
             .eq('id', customer_id)\
             .eq('user_id', user.id)\
             .execute()
         
-        if not existing_customer.data:
+        if not response.data:
             return jsonify({'error': 'Cliente no encontrado'}), 404
         
-        response = supabase.table('customers')\
-            .delete()\
-            .eq('id', customer_id)\
-            .eq('user_id', user.id)\
-            .execute()
-        
+        await _cache_invalidate(_cache_key('customers', user.id))
         return jsonify({'message': 'Cliente eliminado correctamente'})
         
     except Exception as e:
-        logger.error(f"Error eliminando cliente: {e}")
+        logger.error("Error eliminando cliente: %s", e)
         return jsonify({'error': 'Error eliminando cliente'}), 500
 
 # ==================== ENDPOINT DE REPORTES DE PRODUCTOS MÁS VENDIDOS ====================
 
 @app.route('/api/reports/top-products')
-def top_products():
+@require_auth
+async def top_products(user):
     """Obtener productos más vendidos"""
-    user = check_auth()
-    if not user:
-        return jsonify({'error': 'No autorizado'}), 401
-    
     try:
-        # Consulta para obtener productos más vendidos
-        response = supabase.table('sale_items')\
-            .select('quantity, unit_price, products(name)')\
-            .eq('sales.user_id', user.id)\
+        # La agregación y el orden se resuelven en Postgres (vista top_products_per_user)
+        response = await supabase.table('top_products_per_user')\
+            .select('name, quantity, revenue')\
+            .eq('user_id', user.id)\
+            .order('quantity', desc=True)\
+            .limit(10)\
             .execute()
         
-        # Procesar datos para agrupar por producto
-        product_sales = {}
-        for item in response.data:
-            product_name = item['products']['name'] if item['products'] else 'Producto desconocido'
-            if product_name not in product_sales:
-                product_sales[product_name] = {
-                    'quantity': 0,
-                    'revenue': 0
-                }
-            product_sales[product_name]['quantity'] += item['quantity']
-            product_sales[product_name]['revenue'] += item['quantity'] * item['unit_price']
-        
-        # Convertir a lista y ordenar por cantidad
-        top_products_list = [
-            {
-                'name': name,
-                'quantity': data['quantity'],
-                'revenue': data['revenue']
-            }
-            for name, data in product_sales.items()
-        ]
-        top_products_list.sort(key=lambda x: x['quantity'], reverse=True)
-        
-        return jsonify(top_products_list[:10])  # Top 10 productos
+        return jsonify(response.data)
         
     except Exception as e:
-        logger.error(f"Error obteniendo productos más vendidos: {e}")
+        logger.error("Error obteniendo productos más vendidos: %s", e)
         return jsonify({'error': 'Error obteniendo reporte'}), 500
+
+if __name__ == '__main__':
+    port = int(os.environ.get('PORT', 5000))
+    debug_mode = os.environ.get('FLASK_DEBUG', 'False').lower() == 'true'
+    
+    logger.info("=" * 50)
+    logger.info("🚀 INICIANDO SERVIDOR QUART")
+    logger.info("📍 Puerto: %s", port)
+    logger.info("🐛 Debug: %s", debug_mode)
+    logger.info("=" * 50)
+    
+    app.run(debug=debug_mode, port=port, host='0.0.0.0')
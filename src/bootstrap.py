@@ -0,0 +1,24 @@
+import os
+import httpx
+from supabase import create_client, Client, ClientOptions
+from dotenv import load_dotenv
+
+load_dotenv()
+
+supabase_url = os.environ.get('SUPABASE_URL')
+supabase_key = os.environ.get('SUPABASE_KEY')
+
+# Cliente síncrono compartido por los scripts de utilidad (seed_users.py).
+# Un único cliente HTTP/2 con keep-alive reutiliza la misma sesión TLS para
+# todas las altas, en lugar de abrir una conexión nueva por cada usuario.
+http_client = httpx.Client(
+    http2=True,
+    limits=httpx.Limits(max_keepalive_connections=4),
+    timeout=10.0
+)
+
+supabase: Client = create_client(
+    supabase_url,
+    supabase_key,
+    options=ClientOptions(httpx_client=http_client)
+)
@@ -0,0 +1,42 @@
+from bootstrap import supabase
+
+# Usuarios a crear (email, password). Todos se dan de alta con el mismo
+# cliente, reutilizando una única sesión TLS.
+SEED_USERS = [
+    ("admin@ventas.com", "admin123456"),
+    ("test@ventas.com", "test123456"),
+]
+
+def seed_user(email, password):
+    try:
+        # Crear usuario
+        user = supabase.auth.sign_up({
+            "email": email,
+            "password": password,
+        })
+        
+        if user.user:
+            print("✅ USUARIO CREADO EXITOSAMENTE:")
+            print(f"📧 Email: {email}")
+            print(f"🔑 Password: {password}")
+            print("💡 Usa estas credenciales para hacer login")
+        else:
+            print(f"❌ Error creando usuario {email}")
+            
+    except Exception as e:
+        print(f"❌ Error creando usuario {email}: {e}")
+        # Si el usuario ya existe, intenta iniciar sesión para obtener token
+        try:
+            user = supabase.auth.sign_in_with_password({
+                "email": email,
+                "password": password,
+            })
+            print("✅ Usuario ya existe, token obtenido:")
+            print(f"📧 Email: {email}")
+            print(f"Token: {user.session.access_token}")
+        except Exception as e2:
+            print(f"❌ Error completo: {e2}")
+
+if __name__ == '__main__':
+    for email, password in SEED_USERS:
+        seed_user(email, password)
\ No newline at end of file
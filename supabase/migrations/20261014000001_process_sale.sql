@@ -0,0 +1,84 @@
+-- Registra una venta completa en una sola transacción: bloquea las filas de
+-- los productos, valida el stock, inserta la venta y sus items y descuenta
+-- el inventario. Si algo falla, Postgres revierte todo automáticamente.
+--
+-- p_items: [{"product_id": uuid, "quantity": int, "unit_price": numeric?}, ...]
+-- Si un item no trae unit_price se usa el precio actual del producto.
+create or replace function public.process_sale(
+    p_user uuid,
+    p_customer uuid,
+    p_items jsonb
+)
+returns jsonb
+language plpgsql
+as $$
+declare
+    v_product record;
+    v_total numeric;
+    v_sale public.sales;
+begin
+    if p_items is null or jsonb_array_length(p_items) = 0 then
+        raise exception 'La venta debe tener al menos un item'
+            using errcode = '22023';
+    end if;
+
+    -- Bloquear los productos de la venta (en orden para evitar deadlocks)
+    perform 1
+    from public.products p
+    where p.user_id = p_user
+      and p.id in (
+          select i.product_id
+          from jsonb_to_recordset(p_items) as i(product_id uuid)
+      )
+    order by p.id
+    for update;
+
+    -- Validar stock por producto, sumando items repetidos
+    for v_product in
+        select q.product_id, q.quantity, p.id, p.name, p.stock
+        from (
+            select i.product_id, sum(i.quantity) as quantity
+            from jsonb_to_recordset(p_items) as i(product_id uuid, quantity integer)
+            group by i.product_id
+        ) q
+        left join public.products p
+            on p.id = q.product_id and p.user_id = p_user
+    loop
+        if v_product.id is null then
+            raise exception 'Producto % no encontrado', v_product.product_id
+                using errcode = 'P0002';
+        end if;
+        if v_product.stock < v_product.quantity then
+            raise exception 'Stock insuficiente para %. Stock disponible: %',
+                v_product.name, v_product.stock
+                using errcode = 'P0001';
+        end if;
+    end loop;
+
+    select sum(i.quantity * coalesce(i.unit_price, p.price))
+    into v_total
+    from jsonb_to_recordset(p_items) as i(product_id uuid, quantity integer, unit_price numeric)
+    join public.products p on p.id = i.product_id;
+
+    insert into public.sales (total, customer_id, user_id)
+    values (v_total, p_customer, p_user)
+    returning * into v_sale;
+
+    insert into public.sale_items (sale_id, product_id, quantity, unit_price)
+    select v_sale.id, i.product_id, i.quantity, coalesce(i.unit_price, p.price)
+    from jsonb_to_recordset(p_items) as i(product_id uuid, quantity integer, unit_price numeric)
+    join public.products p on p.id = i.product_id;
+
+    update public.products p
+    set stock = p.stock - q.quantity
+    from (
+        select i.product_id, sum(i.quantity) as quantity
+        from jsonb_to_recordset(p_items) as i(product_id uuid, quantity integer)
+        group by i.product_id
+    ) q
+    where p.id = q.product_id
+      and p.user_id = p_user;
+
+    return to_jsonb(v_sale);
+end;
+$$;
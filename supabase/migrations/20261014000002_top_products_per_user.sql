@@ -0,0 +1,18 @@
+-- Ventas agregadas por producto y usuario para el reporte de más vendidos.
+-- security_invoker hace que la vista respete las políticas RLS de las
+-- tablas base en lugar de ejecutarse con los permisos de su dueño.
+create or replace view public.top_products_per_user
+with (security_invoker = true) as
+select
+    s.user_id,
+    p.id as product_id,
+    p.name,
+    sum(si.quantity) as quantity,
+    sum(si.quantity * si.unit_price) as revenue
+from public.sale_items si
+join public.sales s on s.id = si.sale_id
+join public.products p on p.id = si.product_id
+group by s.user_id, p.id, p.name;
+
+create index if not exists sale_items_sale_id_idx on public.sale_items (sale_id);
+create index if not exists sales_user_id_idx on public.sales (user_id);
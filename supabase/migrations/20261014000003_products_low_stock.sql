@@ -0,0 +1,9 @@
+-- Indicador de stock bajo calculado por Postgres al escribir la fila, para
+-- que get_products no tenga que recorrer los productos en Python.
+alter table public.products
+    add column if not exists low_stock boolean
+    generated always as (stock <= coalesce(low_stock_alert, 5)) stored;
+
+create index if not exists products_user_id_low_stock_idx
+    on public.products (user_id)
+    where low_stock;
@@ -0,0 +1,8 @@
+-- Índice para listar las ventas de un usuario por fecha (paginación keyset
+-- de get_sales por (sale_date, id) y rango del reporte diario) sin ordenar
+-- en memoria.
+create index if not exists sales_user_id_sale_date_idx
+    on public.sales (user_id, sale_date desc, id desc);
+
+-- Su prefijo (user_id) ya cubre las búsquedas que usaban este índice
+drop index if exists public.sales_user_id_idx;
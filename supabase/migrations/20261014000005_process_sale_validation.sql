@@ -0,0 +1,97 @@
+-- process_sale pasa a ser la única validación de la venta: create_sale ya no
+-- consulta el stock antes de llamarla. Los errores de validación usan
+-- SQLSTATE propios (clase LS) para que la API traduzca a 400/404 solo estos
+-- casos y no cualquier error de PL/pgSQL (P0001 es el código por defecto de
+-- RAISE EXCEPTION, y 22023 lo lanzan también funciones internas):
+--   LS001 -> datos de la venta inválidos (400)
+--   LS002 -> stock insuficiente (400)
+--   LS003 -> producto no encontrado (404)
+-- Las filas de productos se bloquean con FOR UPDATE, así dos ventas
+-- simultáneas del mismo producto se serializan y no dejan stock negativo.
+create or replace function public.process_sale(
+    p_user uuid,
+    p_customer uuid,
+    p_items jsonb
+)
+returns jsonb
+language plpgsql
+as $$
+declare
+    v_product record;
+    v_total numeric;
+    v_sale public.sales;
+begin
+    if p_items is null or jsonb_array_length(p_items) = 0 then
+        raise exception 'La venta debe tener al menos un item'
+            using errcode = 'LS001';
+    end if;
+
+    if exists (
+        select 1
+        from jsonb_to_recordset(p_items) as i(product_id uuid, quantity integer)
+        where i.product_id is null or i.quantity is null or i.quantity <= 0
+    ) then
+        raise exception 'Cada item debe tener product_id y quantity'
+            using errcode = 'LS001';
+    end if;
+
+    -- Bloquear los productos de la venta (en orden para evitar deadlocks)
+    perform 1
+    from public.products p
+    where p.user_id = p_user
+      and p.id in (
+          select i.product_id
+          from jsonb_to_recordset(p_items) as i(product_id uuid)
+      )
+    order by p.id
+    for update;
+
+    -- Validar stock por producto, sumando items repetidos
+    for v_product in
+        select q.product_id, q.quantity, p.id, p.name, p.stock
+        from (
+            select i.product_id, sum(i.quantity) as quantity
+            from jsonb_to_recordset(p_items) as i(product_id uuid, quantity integer)
+            group by i.product_id
+        ) q
+        left join public.products p
+            on p.id = q.product_id and p.user_id = p_user
+    loop
+        if v_product.id is null then
+            raise exception 'Producto % no encontrado', v_product.product_id
+                using errcode = 'LS003';
+        end if;
+        if v_product.stock < v_product.quantity then
+            raise exception 'Stock insuficiente para %. Stock disponible: %',
+                v_product.name, v_product.stock
+                using errcode = 'LS002';
+        end if;
+    end loop;
+
+    select sum(i.quantity * coalesce(i.unit_price, p.price))
+    into v_total
+    from jsonb_to_recordset(p_items) as i(product_id uuid, quantity integer, unit_price numeric)
+    join public.products p on p.id = i.product_id;
+
+    insert into public.sales (total, customer_id, user_id)
+    values (v_total, p_customer, p_user)
+    returning * into v_sale;
+
+    insert into public.sale_items (sale_id, product_id, quantity, unit_price)
+    select v_sale.id, i.product_id, i.quantity, coalesce(i.unit_price, p.price)
+    from jsonb_to_recordset(p_items) as i(product_id uuid, quantity integer, unit_price numeric)
+    join public.products p on p.id = i.product_id;
+
+    update public.products p
+    set stock = p.stock - q.quantity
+    from (
+        select i.product_id, sum(i.quantity) as quantity
+        from jsonb_to_recordset(p_items) as i(product_id uuid, quantity integer)
+        group by i.product_id
+    ) q
+    where p.id = q.product_id
+      and p.user_id = p_user;
+
+    return to_jsonb(v_sale);
+end;
+$$;